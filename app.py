@@ -1,10 +1,26 @@
 import streamlit as st
 import os
 import tempfile
-from langgraph_mcp_bot import app
-from tools.file_upload import update_faiss_index
+from dotenv import load_dotenv
+
+# Load .env before any tool is built; either cached resource may be created first
+load_dotenv()
 
 st.set_page_config(page_title="MCP Chatbot", page_icon="🤖")
+
+
+@st.cache_resource
+def get_chatbot():
+    # Imported lazily so the page renders before the LangGraph tools are built
+    from langgraph_mcp_bot import app
+    return app
+
+
+@st.cache_resource
+def get_index_updater():
+    from tools.file_upload import update_faiss_index
+    return update_faiss_index
+
 st.title("🧠 LangGraph MCP Chatbot")
 
 # File upload section
@@ -29,6 +45,7 @@ if uploaded_files:
                     temp_files.append(tmp_file.name)
             
             # Update FAISS index
+            update_faiss_index = get_index_updater()
             num_chunks, status = update_faiss_index(temp_files)
             
             # Clean up temporary files
@@ -47,11 +64,14 @@ st.markdown("---")
 st.markdown("### 💬 Chat")
 st.caption("Order of sources: RAG ➜ MySQL ➜ Web Search (SerpAPI)")
 
-user_input = st.text_input("Enter your question:")
+# Cap question length so a pasted document can't blow the model's context
+user_input = st.text_input("Enter your question:", max_chars=2000)
+question = user_input.strip()
 
-if user_input:
+# Whitespace-only input would still fan out to every source; skip it
+if question:
     with st.spinner("Searching..."):
-        state = {"input": user_input}
-        result = app.invoke(state)
+        state = {"input": question}
+        result = get_chatbot().invoke(state)
         st.markdown("### 🤖 Response")
         st.write(result["final_answer"])
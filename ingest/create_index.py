@@ -1,9 +1,12 @@
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+"""Write the sample document and rebuild the FAISS index from data/*.txt.
+
+Run from the repository root as a module so the tools package resolves:
+    python -m ingest.create_index
+"""
 import os
+import glob
 from dotenv import load_dotenv
+from tools.file_upload import rebuild_faiss_index
 
 load_dotenv()
 
@@ -13,11 +16,9 @@ def create_faiss_index():
     # Get absolute paths
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     data_dir = os.path.join(base_dir, "data")
-    faiss_dir = os.path.join(base_dir, "faiss_index")
     
     print(f"Base directory: {base_dir}")
     print(f"Data directory: {data_dir}")
-    print(f"FAISS directory: {faiss_dir}")
     
     # Create data directory and sample document
     if not os.path.exists(data_dir):
@@ -37,37 +38,15 @@ def create_faiss_index():
         The system tries each source in sequence until it finds a good answer.
         """)
     
-    # Load documents
-    print("Loading documents...")
-    loader = DirectoryLoader(data_dir, glob="**/*.txt", loader_cls=TextLoader)
-    documents = loader.load()
-    print(f"Loaded {len(documents)} documents")
-    
-    if not documents:
-        raise ValueError("No documents found in the data directory!")
-    
-    # Split documents
-    print("Splitting documents...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-    )
-    texts = text_splitter.split_documents(documents)
-    print(f"Created {len(texts)} text chunks")
-    
-    # Create and save FAISS index
-    print("Creating embeddings and FAISS index...")
-    embeddings = OpenAIEmbeddings()
-    db = FAISS.from_documents(texts, embeddings)
-    
-    # Create faiss_index directory if it doesn't exist
-    if not os.path.exists(faiss_dir):
-        print(f"Creating FAISS index directory at {faiss_dir}")
-        os.makedirs(faiss_dir)
-    
-    # Save the index
-    print("Saving FAISS index...")
-    db.save_local(faiss_dir)
+    # Parse, split, embed and save through the same pipeline as uploads, so
+    # the index is swapped in atomically, the delta is cleared and large
+    # corpora get the IVF index
+    file_paths = sorted(glob.glob(os.path.join(data_dir, "**", "*.txt"), recursive=True))
+    print(f"Indexing {len(file_paths)} documents...")
+    num_chunks, status = rebuild_faiss_index(file_paths)
+    if not num_chunks:
+        raise ValueError(status)
+    print(f"Created {num_chunks} text chunks")
     print("FAISS index created successfully!")
 
 if __name__ == "__main__":
@@ -1,22 +1,23 @@
-from langchain.vectorstores import FAISS
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.document_loaders import PyPDFLoader, TextLoader
+"""Rebuild the knowledge base from the files under data/.
+
+Run from the repository root as a module so the tools package resolves:
+    python -m ingest.ingest_files
+"""
 import os
+from tools.file_upload import rebuild_faiss_index
 
 def ingest_docs():
-    embeddings = OpenAIEmbeddings()
-    docs = []
-    for file in os.listdir("data"):
-        if file.endswith(".pdf"):
-            loader = PyPDFLoader(f"data/{file}")
-        elif file.endswith(".txt"):
-            loader = TextLoader(f"data/{file}")
-        else:
-            continue
-        docs.extend(loader.load())
-
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    vectorstore.save_local("faiss_index", allow_dangerous_deserialization=True)
+    # Route through the same pipeline as the upload form so PDFs are parsed
+    # once by load_pdf and chunks are split and embedded identically. The
+    # index is rebuilt rather than appended to, so re-running is safe
+    data_dir = "data"
+    file_paths = [
+        os.path.join(data_dir, file)
+        for file in sorted(os.listdir(data_dir))
+        if file.endswith((".pdf", ".txt"))
+    ]
+    num_chunks, status = rebuild_faiss_index(file_paths)
+    print(f"{status} Indexed {num_chunks} chunks.")
 
 if __name__ == "__main__":
     ingest_docs()
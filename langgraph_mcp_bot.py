@@ -1,59 +1,73 @@
-import os
+import re
+import logging
 from dotenv import load_dotenv
-from typing import TypedDict, Optional
+import operator
+from typing import Annotated, TypedDict, Optional
 
 from tools.rag_tool import get_rag_chain
 from tools.mysql_tool import get_mysql_agent
 from tools.serpapi_tool import get_serp_tool
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langgraph.graph import StateGraph, END, START
+from langgraph.graph import StateGraph, START
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class ChatState(TypedDict, total=False):
     input: str
     rag_context: Optional[str]
     sql_context: Optional[str]
     serp_context: Optional[str]
     final_answer: Optional[str]
-    found: bool
-
-# Initialize tools
-rag_chain = get_rag_chain()
-mysql_agent = get_mysql_agent()
+    # Sources report concurrently; any one finding an answer counts
+    found: Annotated[bool, operator.or_]
+
+# Phrases that mean the SQL agent did not actually answer, matched in one pass
+SQL_NO_ANSWER_RE = re.compile(
+    "|".join(re.escape(phrase) for phrase in (
+        "error",
+        "i don't know",
+        "no relevant information",
+        "could not find",
+        "invalid format",
+        "could not parse",
+        "no results",
+    )),
+    re.IGNORECASE,
+)
+
+# Initialize tools; the RAG chain and SQL agent are fetched per query so
+# uploads are picked up and a database that was down at startup is retried
 serp_tool = get_serp_tool()
 
 def rag_node(state: ChatState) -> ChatState:
-    # Initialize state fields
-    if "found" not in state:
-        state["found"] = False
-    if "rag_context" not in state:
-        state["rag_context"] = None
-    if "sql_context" not in state:
-        state["sql_context"] = None
-    if "serp_context" not in state:
-        state["serp_context"] = None
-    if "final_answer" not in state:
-        state["final_answer"] = None
+    # Nodes run in parallel, so each returns only the keys it owns
+    try:
+        rag_chain = get_rag_chain()
+        if not rag_chain:  # No knowledge base has been indexed yet
+            return {"rag_context": None, "found": False}
         
-    response = rag_chain.invoke(state["input"])
+        response = rag_chain.invoke(state["input"])
+    except Exception as e:
+        # e.g. an index version pruned between resolving and opening it
+        logger.error("RAG Error: %s", e)
+        return {"rag_context": None, "found": False}
+    
     if isinstance(response, dict):
         response_text = response.get('result', '')
     else:
         response_text = str(response)
     
     if "I don't know" in response_text or len(response_text.strip()) < 5:
-        state["rag_context"] = None
-        state["found"] = False
-    else:
-        state["rag_context"] = response_text
-        state["found"] = True
-    return state
+        return {"rag_context": None, "found": False}
+    return {"rag_context": response_text, "found": True}
 
 def mysql_node(state: ChatState) -> ChatState:
+    mysql_agent = get_mysql_agent()
+    if not mysql_agent:  # Database is unavailable
+        return {"sql_context": None, "found": False}
+        
     try:
         # Run MySQL agent and get response
         response = mysql_agent.run(state["input"])
@@ -62,62 +76,41 @@ def mysql_node(state: ChatState) -> ChatState:
         result = str(response).strip()
         
         # Check if we got a meaningful result
-        meaningful = (
-            len(result) > 0 and
-            "error" not in result.lower() and
-            "i don't know" not in result.lower() and
-            "no relevant information" not in result.lower() and
-            "could not find" not in result.lower() and
-            "invalid format" not in result.lower() and
-            "could not parse" not in result.lower() and
-            "no results" not in result.lower()
-        )
+        meaningful = len(result) > 0 and not SQL_NO_ANSWER_RE.search(result)
             
-        state["sql_context"] = result if meaningful else None
-        state["found"] = meaningful
+        return {"sql_context": result if meaningful else None, "found": meaningful}
         
     except Exception as e:
-        print(f"MySQL Error: {str(e)}")
-        state["sql_context"] = None
-        state["found"] = False
-    return state
+        logger.error("MySQL Error: %s", e)
+        return {"sql_context": None, "found": False}
 
 def serp_node(state: ChatState) -> ChatState:
     if not serp_tool:  # If tool wasn't created successfully
-        state["serp_context"] = None
-        state["found"] = False
-        return state
+        return {"serp_context": None, "found": False}
         
     try:
         response = serp_tool.run(state["input"])
         if response:  # Only set context if we got a valid response
-            state["serp_context"] = response
-            state["found"] = True
-        else:
-            state["serp_context"] = None
-            state["found"] = False
+            return {"serp_context": response, "found": True}
+        return {"serp_context": None, "found": False}
     except Exception as e:
-        print(f"SerpAPI Error: {str(e)}")
-        state["serp_context"] = None
-        state["found"] = False
-    return state
+        logger.error("SerpAPI Error: %s", e)
+        return {"serp_context": None, "found": False}
+
+# State key and label for each source, in the order they are presented
+ANSWER_SOURCES = (
+    ("rag_context", "From knowledge base"),
+    ("sql_context", "From database"),
+    ("serp_context", "From web search"),
+)
 
 def final_answer_node(state: ChatState) -> ChatState:
-    # Initialize final answer
-    state['final_answer'] = ""
-    sources = []
-    
-    # Check RAG result
-    if state.get('rag_context') and state.get('rag_context') != 'None':
-        sources.append(f"From knowledge base: {state['rag_context']}")
-    
-    # Check MySQL result
-    if state.get('sql_context') and state.get('sql_context') != 'None':
-        sources.append(f"From database: {state['sql_context']}")
-    
-    # Check web search result
-    if state.get('serp_context') and state.get('serp_context') != 'None':
-        sources.append(f"From web search: {state['serp_context']}")
+    # Collect every source that produced a result in a single pass
+    sources = [
+        f"{label}: {context}"
+        for key, label in ANSWER_SOURCES
+        if (context := state.get(key)) and context != 'None'
+    ]
     
     # Combine all found sources
     if sources:
@@ -130,26 +123,20 @@ def final_answer_node(state: ChatState) -> ChatState:
 # LangGraph flow
 graph = StateGraph(ChatState)
 
-# Set entry point - always start with RAG
-graph.set_entry_point("RAG")
-
 # Add nodes
 graph.add_node("RAG", rag_node)
 graph.add_node("MySQL", mysql_node)
 graph.add_node("WebSearch", serp_node)
 graph.add_node("Answer", final_answer_node)
 
-# Define edges for sequential flow:
-# RAG -> MySQL -> WebSearch -> Answer
-
-# After RAG, always try MySQL next
-graph.add_edge("RAG", "MySQL")
-
-# After MySQL, always try WebSearch next
-graph.add_edge("MySQL", "WebSearch")
+# Fan out: the three sources only read the input, so query them concurrently
+# and let latency be the slowest source rather than the sum of all three
+graph.add_edge(START, "RAG")
+graph.add_edge(START, "MySQL")
+graph.add_edge(START, "WebSearch")
 
-# After WebSearch, go to final answer
-graph.add_edge("WebSearch", "Answer")
+# Fan in: Answer waits for every source before combining them
+graph.add_edge(["RAG", "MySQL", "WebSearch"], "Answer")
 
 # Set finish point
 graph.set_finish_point("Answer")
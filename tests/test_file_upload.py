@@ -0,0 +1,143 @@
+import os
+
+import faiss
+import pytest
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from tools import file_upload
+from tools.index_manifest import LEGACY_DELTA_NAME, new_version_dir, read_manifest, write_manifest
+
+DIM = 8
+
+
+@pytest.fixture
+def index_dirs(tmp_path, monkeypatch):
+    faiss_dir = str(tmp_path / "faiss_index")
+    embeddings = FakeEmbeddings(size=DIM)
+    monkeypatch.setattr(file_upload, "FAISS_DIR", faiss_dir)
+    monkeypatch.setattr(file_upload, "_get_embeddings", lambda: embeddings)
+    return faiss_dir, embeddings
+
+
+def _save_store(texts, embeddings, faiss_dir):
+    store = FAISS.from_texts(texts, embeddings, **file_upload.INDEX_KWARGS)
+    store.save_local(faiss_dir)
+
+
+def _publish(faiss_dir, embeddings, texts, kind):
+    """Save `texts` as a new main or delta version and swap it in."""
+    main_dir, delta_dir = read_manifest(faiss_dir)
+    version_dir = new_version_dir(faiss_dir)
+    _save_store(texts, embeddings, version_dir)
+    if kind == "main":
+        main_dir = version_dir
+    else:
+        delta_dir = version_dir
+    write_manifest(faiss_dir, main_dir, delta_dir)
+
+
+def _load_main(faiss_dir, embeddings):
+    main_dir, _ = read_manifest(faiss_dir)
+    return FAISS.load_local(
+        main_dir, embeddings, allow_dangerous_deserialization=True, **file_upload.INDEX_KWARGS
+    )
+
+
+def _centroids(store):
+    index = faiss.downcast_index(store.index)
+    return index.quantizer.reconstruct_n(0, index.nlist)
+
+
+def test_compact_merges_delta_into_main(index_dirs):
+    faiss_dir, embeddings = index_dirs
+    _publish(faiss_dir, embeddings, ["a", "b", "c"], "main")
+    _publish(faiss_dir, embeddings, ["d", "e"], "delta")
+
+    assert file_upload.compact_faiss_index() == 2
+
+    main = _load_main(faiss_dir, embeddings)
+    assert main.index.ntotal == 5
+    assert len(main.index_to_docstore_id) == 5
+    assert read_manifest(faiss_dir)[1] is None
+
+
+def test_compact_migrates_legacy_layout(index_dirs):
+    faiss_dir, embeddings = index_dirs
+    legacy_delta = os.path.join(faiss_dir, LEGACY_DELTA_NAME)
+    _save_store(["a", "b", "c"], embeddings, faiss_dir)
+    _save_store(["d", "e"], embeddings, legacy_delta)
+
+    assert file_upload.compact_faiss_index() == 2
+    assert _load_main(faiss_dir, embeddings).index.ntotal == 5
+    # Kept for readers that resolved the old layout, until the next swap
+    assert os.path.exists(legacy_delta)
+
+    _publish(faiss_dir, embeddings, ["f"], "delta")
+    assert not os.path.exists(legacy_delta)
+
+
+def test_swaps_prune_versions_older_than_the_previous_manifest(index_dirs):
+    faiss_dir, embeddings = index_dirs
+    _publish(faiss_dir, embeddings, ["a"], "main")
+    first_main, _ = read_manifest(faiss_dir)
+    _publish(faiss_dir, embeddings, ["b"], "main")
+    assert os.path.exists(first_main)
+
+    _publish(faiss_dir, embeddings, ["c"], "main")
+    assert not os.path.exists(first_main)
+
+
+def test_compact_promotes_delta_without_main(index_dirs):
+    faiss_dir, embeddings = index_dirs
+    _publish(faiss_dir, embeddings, ["d", "e"], "delta")
+
+    assert file_upload.compact_faiss_index() == 2
+    assert _load_main(faiss_dir, embeddings).index.ntotal == 2
+
+
+def test_compact_promotes_large_delta_to_ivf(index_dirs, monkeypatch):
+    faiss_dir, embeddings = index_dirs
+    monkeypatch.setattr(file_upload, "IVF_MIN_VECTORS", 50)
+    _publish(faiss_dir, embeddings, [f"doc {i}" for i in range(60)], "delta")
+
+    assert file_upload.compact_faiss_index() == 60
+    main = _load_main(faiss_dir, embeddings)
+    assert isinstance(faiss.downcast_index(main.index), faiss.IndexIVF)
+    assert main.index.ntotal == 60
+
+
+def test_compact_adds_delta_to_ivf_main_without_retraining(index_dirs, monkeypatch):
+    faiss_dir, embeddings = index_dirs
+    monkeypatch.setattr(file_upload, "IVF_MIN_VECTORS", 50)
+    _publish(faiss_dir, embeddings, [f"doc {i}" for i in range(60)], "delta")
+    file_upload.compact_faiss_index()
+    centroids_before = _centroids(_load_main(faiss_dir, embeddings))
+    _publish(faiss_dir, embeddings, ["d", "e"], "delta")
+
+    assert file_upload.compact_faiss_index() == 2
+
+    main = _load_main(faiss_dir, embeddings)
+    assert main.index.ntotal == 62
+    assert main.docstore.search(main.index_to_docstore_id[61]).page_content == "e"
+    assert (_centroids(main) == centroids_before).all()
+
+
+def test_compact_without_delta_is_a_no_op(index_dirs):
+    assert file_upload.compact_faiss_index() == 0
+
+
+def test_rebuild_replaces_main_and_clears_delta(index_dirs, monkeypatch):
+    faiss_dir, embeddings = index_dirs
+    _publish(faiss_dir, embeddings, ["stale"], "delta")
+    chunks = [Document(page_content="Some text to index.", metadata={"source": "doc.txt"})]
+    monkeypatch.setattr(file_upload, "_load_chunks", lambda file_paths: chunks)
+
+    # Re-running must not duplicate chunks
+    for _ in range(2):
+        num_chunks, _ = file_upload.rebuild_faiss_index(["doc.txt"])
+        assert num_chunks == 1
+
+    assert _load_main(faiss_dir, embeddings).index.ntotal == 1
+    assert read_manifest(faiss_dir)[1] is None
@@ -1,33 +1,156 @@
 import os
-from typing import List, Tuple
+import math
+import logging
+import time
+import functools
+import random
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+import faiss
+import numpy as np
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from tools.index_manifest import new_version_dir, read_manifest, write_manifest
 
-def load_pdf(file_path: str) -> List[str]:
-    """Load a PDF file using PyPDF2."""
+logger = logging.getLogger(__name__)
+
+# Serialises manifest swaps: uploads replace the delta, compaction and
+# rebuilds replace both
+_index_lock = threading.Lock()
+_compaction_thread: Optional[threading.Thread] = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Uploads land in a small delta index that is periodically merged into the
+# main index; see tools.index_manifest for the directory layout
+FAISS_DIR = os.path.join(BASE_DIR, "faiss_index")
+# Kept well below IVF_MIN_VECTORS so the flat delta stays cheap to load and
+# rewrite on every upload
+DELTA_COMPACT_THRESHOLD = 2_000
+# Compaction switches the main index from a flat scan to an IVF index with
+# 8-bit codes (4x smaller than float32) once it holds this many vectors;
+# below that a flat scan is already fast and small
+IVF_MIN_VECTORS = 10_000
+# Training vectors drawn per IVF list; k-means gains little beyond this
+IVF_TRAIN_POINTS_PER_LIST = 256
+# OpenAI embeddings are meant for cosine similarity: store unit vectors and
+# search by inner product, FAISS's best-optimised SIMD kernel
+INDEX_KWARGS = {"distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT, "normalize_L2": True}
+
+# Upper bound on processes used to parse uploaded files in parallel
+MAX_FILE_WORKERS = min(os.cpu_count() or 1, 4)
+# PDFs with at least this many pages have their pages extracted in parallel.
+# PyMuPDF takes ~3-5 ms per dense text page; starting the pool costs ~20 ms
+# with fork but ~5 s with spawn, where every worker re-imports langchain
+PDF_PARALLEL_MIN_PAGES = 64 if multiprocessing.get_all_start_methods()[0] == "fork" else 2000
+MAX_PAGE_WORKERS = min(os.cpu_count() or 1, 6)
+# Texts per embed_documents call and number of calls kept in flight
+EMBED_BATCH_SIZE = 2048
+MAX_EMBED_WORKERS = 5
+EMBED_JITTER_SECONDS = 0.5
+
+@functools.lru_cache(maxsize=1)
+def _get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Shared splitter, built once per process on first use."""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name="text-embedding-ada-002",
+        chunk_size=400,
+        chunk_overlap=0,
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_embeddings() -> Embeddings:
+    """Shared embedder, built once per process on first use.
+    Vectors are cached on disk by content hash, so re-uploading an edited
+    document only pays for the chunks that changed.
+    """
+    # Retries are handled by _embed_with_backoff; retrying in the client as
+    # well would multiply the attempts per batch. The client batches by input
+    # count only: 500 chunks of up to 400 tokens stay under the API's
+    # 300k-tokens-per-request limit
+    underlying_embeddings = OpenAIEmbeddings(chunk_size=500, max_retries=0)
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying_embeddings,
+        LocalFileStore(os.path.join(FAISS_DIR, ".emb_cache")),
+        namespace=underlying_embeddings.model,
+    )
+
+def _import_pypdf():
     try:
         import pypdf
     except ImportError:
         raise ImportError(
             "pypdf package not found, please install it with 'pip install pypdf'"
         )
-    
-    # Create a PDF reader object
+    return pypdf
+
+def _import_fitz():
+    """Return PyMuPDF if installed; it extracts text several times faster than pypdf."""
+    try:
+        import fitz
+    except ImportError:
+        return None
+    return fitz
+
+def _pdf_page_count(file_path: str) -> int:
+    fitz = _import_fitz()
+    if fitz:
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    pypdf = _import_pypdf()
     with open(file_path, 'rb') as file:
-        pdf = pypdf.PdfReader(file)
-        text = ''
-        # Extract text from each page
-        for page in pdf.pages:
-            text += page.extract_text() + '\n'
-        
-        # Create a document with metadata
-        from langchain_core.documents import Document
-        return [Document(
-            page_content=text,
-            metadata={"source": file_path}
-        )]
+        return len(pypdf.PdfReader(file).pages)
+
+def _pdf_page_texts(file_path: str, page_numbers: Iterable[int]) -> List[str]:
+    """Extract the text of the given pages, opening the file once."""
+    fitz = _import_fitz()
+    if fitz:
+        with fitz.open(file_path) as doc:
+            return [doc[i].get_text("text") for i in page_numbers]
+    pypdf = _import_pypdf()
+    with open(file_path, 'rb') as file:
+        pages = pypdf.PdfReader(file).pages
+        return [pages[i].extract_text() for i in page_numbers]
+
+def _extract_pages(args: Tuple[str, int, int]) -> List[str]:
+    """Extract the text of a contiguous page range; runs in a worker process.
+    PDF readers don't pickle, so each worker opens the file once for its range.
+    """
+    file_path, start, stop = args
+    return _pdf_page_texts(file_path, range(start, stop))
+
+def load_pdf(file_path: str) -> List[str]:
+    """Load a PDF file using PyMuPDF, falling back to pypdf."""
+    n_pages = _pdf_page_count(file_path)
+    # Fan large PDFs out across processes, unless we are already running
+    # inside a file worker, to avoid nesting process pools
+    if (n_pages >= PDF_PARALLEL_MIN_PAGES and MAX_PAGE_WORKERS > 1
+            and multiprocessing.parent_process() is None):
+        # One contiguous range per worker rather than one task per page
+        step = math.ceil(n_pages / MAX_PAGE_WORKERS)
+        ranges = [(file_path, start, min(start + step, n_pages)) for start in range(0, n_pages, step)]
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            pages = [text for texts in executor.map(_extract_pages, ranges) for text in texts]
+    else:
+        pages = _pdf_page_texts(file_path, range(n_pages))
+    # Join the page texts once at the end
+    text = ''.join(page_text + '\n' for page_text in pages)
+    
+    # Create a document with metadata
+    return [Document(
+        page_content=text,
+        metadata={"source": file_path}
+    )]
 
 def process_file(file_path: str) -> List[str]:
     """Process a file and return its chunks."""
@@ -36,56 +159,250 @@ def process_file(file_path: str) -> List[str]:
         _, ext = os.path.splitext(file_path)
         ext = ext.lower()
         
-        # Load document based on type
+        # Load document based on type; iterate lazily so only one document
+        # is held alongside its chunks at a time
         if ext == '.pdf':
-            documents = load_pdf(file_path)
+            documents = iter(load_pdf(file_path))
         elif ext == '.txt':
             loader = TextLoader(file_path)
-            documents = loader.load()
+            documents = loader.lazy_load()
         else:
             raise ValueError(f"Unsupported file type: {ext}")
         
         # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        return text_splitter.split_documents(documents)
+        text_splitter = _get_text_splitter()
+        chunks = []
+        for document in documents:
+            chunks.extend(text_splitter.split_documents([document]))
+        return chunks
     except Exception as e:
-        print(f"Error processing file {file_path}: {str(e)}")
+        logger.error("Error processing file %s: %s", file_path, e)
         raise
 
+@retry(
+    retry=retry_if_exception_type(
+        (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+    ),
+    wait=wait_exponential_jitter(initial=1, max=32),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+def _embed_with_backoff(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed a batch, backing off exponentially on rate limits and transient errors."""
+    return embeddings.embed_documents(texts)
+
+def _embed_batch(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    # Stagger request starts so concurrent batches don't hit the API in one burst
+    time.sleep(random.uniform(0, EMBED_JITTER_SECONDS))
+    return _embed_with_backoff(embeddings, texts)
+
+def _embed_texts(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed texts in concurrent sub-batches, returning vectors in input order."""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    if len(batches) == 1:
+        return _embed_with_backoff(embeddings, batches[0])
+    
+    vectors = []
+    with ThreadPoolExecutor(max_workers=MAX_EMBED_WORKERS) as executor:
+        for batch_vectors in executor.map(lambda batch: _embed_batch(embeddings, batch), batches):
+            vectors.extend(batch_vectors)
+    return vectors
+
+def _save_version(db: FAISS) -> str:
+    """Save a FAISS store to a new version directory and return its path.
+    Nothing reads it until write_manifest points at it.
+    """
+    version_dir = new_version_dir(FAISS_DIR)
+    db.save_local(version_dir)
+    return version_dir
+
+def _load_index(faiss_dir: Optional[str], embeddings: Embeddings) -> Optional[FAISS]:
+    """Load a saved FAISS store for writing, or None if none has been saved.
+    Any other failure (a corrupt or unreadable file) propagates, so callers
+    never mistake a damaged index for a missing one and overwrite it.
+    """
+    if not faiss_dir or not os.path.exists(os.path.join(faiss_dir, "index.faiss")):
+        return None
+    return FAISS.load_local(faiss_dir, embeddings, allow_dangerous_deserialization=True, **INDEX_KWARGS)
+
+def _load_chunks(file_paths: List[str]) -> List[Document]:
+    # Process all files; parsing and splitting are CPU-bound, so spread
+    # multiple files across processes (map keeps chunks in input order)
+    all_chunks = []
+    if len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=MAX_FILE_WORKERS) as executor:
+            for chunks in executor.map(process_file, file_paths):
+                all_chunks.extend(chunks)
+    else:
+        for file_path in file_paths:
+            all_chunks.extend(process_file(file_path))
+    return all_chunks
+
 def update_faiss_index(file_paths: List[str]) -> Tuple[int, str]:
     """Update FAISS index with new documents.
     Returns: (number of chunks added, status message)
     """
     try:
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        faiss_dir = os.path.join(base_dir, "faiss_index")
-        
-        # Process all files
-        all_chunks = []
-        for file_path in file_paths:
-            chunks = process_file(file_path)
-            all_chunks.extend(chunks)
-        
+        all_chunks = _load_chunks(file_paths)
         if not all_chunks:
             return 0, "No content found in the uploaded files."
         
-        # Create embeddings
-        embeddings = OpenAIEmbeddings()
+        # Embed every chunk up front, several large requests at a time
+        embeddings = _get_embeddings()
+        texts = [chunk.page_content for chunk in all_chunks]
+        metadatas = [chunk.metadata for chunk in all_chunks]
+        text_embeddings = list(zip(texts, _embed_texts(embeddings, texts)))
         
-        # Load existing index if it exists, otherwise create new
-        if os.path.exists(faiss_dir):
-            db = FAISS.load_local(faiss_dir, embeddings, allow_dangerous_deserialization=True)
-            db.add_documents(all_chunks)
-        else:
-            db = FAISS.from_documents(all_chunks, embeddings)
-            os.makedirs(faiss_dir, exist_ok=True)
+        # New vectors only go into the small delta index, so an upload costs
+        # O(new vectors) instead of rewriting the whole main index
+        with _index_lock:
+            main_dir, delta_dir = read_manifest(FAISS_DIR)
+            db = _load_index(delta_dir, embeddings)
+            if db is None:
+                db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, **INDEX_KWARGS)
+            else:
+                db.add_embeddings(text_embeddings, metadatas=metadatas)
+            
+            # Save the updated delta as a new version alongside the same main
+            write_manifest(FAISS_DIR, main_dir, _save_version(db))
         
-        # Save updated index
-        db.save_local(faiss_dir)
+        # Fold the delta into the main index once it stops being small; the
+        # upload is already saved, so this happens off the request
+        if db.index.ntotal >= DELTA_COMPACT_THRESHOLD:
+            _start_background_compaction()
         
         return len(all_chunks), "Successfully added to the knowledge base."
     except Exception as e:
         return 0, f"Error updating index: {str(e)}"
+
+def rebuild_faiss_index(file_paths: List[str]) -> Tuple[int, str]:
+    """Replace the main index with one built from `file_paths` alone and
+    clear the delta, so re-running an ingest never duplicates chunks.
+    Returns: (number of chunks indexed, status message)
+    """
+    try:
+        all_chunks = _load_chunks(file_paths)
+        if not all_chunks:
+            return 0, "No content found in the given files."
+        
+        embeddings = _get_embeddings()
+        texts = [chunk.page_content for chunk in all_chunks]
+        metadatas = [chunk.metadata for chunk in all_chunks]
+        text_embeddings = list(zip(texts, _embed_texts(embeddings, texts)))
+        db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, **INDEX_KWARGS)
+        _to_ivf_if_large(db)
+        
+        with _index_lock:
+            write_manifest(FAISS_DIR, _save_version(db), None)
+        return len(all_chunks), "Successfully rebuilt the knowledge base."
+    except Exception as e:
+        return 0, f"Error rebuilding index: {str(e)}"
+
+def _compact_logged() -> None:
+    try:
+        moved = compact_faiss_index()
+        logger.info("Compacted %d delta vectors into the main FAISS index", moved)
+    except Exception as e:
+        # The delta is left in place, so the next upload retries
+        logger.error("Error compacting FAISS index: %s", e)
+
+def _start_background_compaction() -> None:
+    """Run compact_faiss_index in a background thread unless one is running.
+    The thread is not a daemon, so a script exiting after an upload waits
+    for the compaction to finish.
+    """
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return
+    _compaction_thread = threading.Thread(target=_compact_logged, name="faiss-compaction")
+    _compaction_thread.start()
+
+def _index_vectors(index: faiss.Index) -> np.ndarray:
+    """Return every vector stored in `index`, in id order."""
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def _training_sample(parts: List[np.ndarray], size: int) -> np.ndarray:
+    """Draw up to `size` random rows across `parts` without stacking them all."""
+    total = sum(len(part) for part in parts)
+    if total <= size:
+        return np.vstack(parts)
+    picks = np.sort(np.random.default_rng().choice(total, size, replace=False))
+    rows, offset = [], 0
+    for part in parts:
+        in_part = picks[(picks >= offset) & (picks < offset + len(part))]
+        rows.append(part[in_part - offset])
+        offset += len(part)
+    return np.vstack(rows)
+
+def _train_ivf_index(parts: List[np.ndarray]) -> faiss.Index:
+    """Return an empty inner-product IVF index with nlist ~ sqrt(N) and int8
+    scalar-quantised codes, trained on a random sample of the rows in `parts`.
+    """
+    nlist = int(math.sqrt(sum(len(part) for part in parts)))
+    sample = _training_sample(parts, IVF_TRAIN_POINTS_PER_LIST * nlist)
+    index = faiss.index_factory(sample.shape[1], f"IVF{nlist},SQ8", faiss.METRIC_INNER_PRODUCT)
+    index.train(sample)
+    return index
+
+def _index_with_vectors(trained: faiss.Index, vectors: np.ndarray) -> faiss.Index:
+    index = faiss.clone_index(trained)
+    index.add(vectors)
+    return index
+
+def _to_ivf_if_large(db: FAISS) -> None:
+    """Move a flat store onto an IVF index once it holds IVF_MIN_VECTORS."""
+    if db.index.ntotal >= IVF_MIN_VECTORS:
+        vectors = _index_vectors(db.index)
+        db.index = _index_with_vectors(_train_ivf_index([vectors]), vectors)
+
+def compact_faiss_index() -> int:
+    """Merge the delta index into the main index and clear the delta.
+    Safe to call at any time, e.g. from an admin job.
+    Returns: number of vectors moved into the main index
+    """
+    with _index_lock:
+        return _compact_locked(_get_embeddings())
+
+def _compact_locked(embeddings: Embeddings) -> int:
+    main_dir, delta_dir = read_manifest(FAISS_DIR)
+    delta = _load_index(delta_dir, embeddings)
+    if delta is None:
+        return 0
+    moved = len(delta.index_to_docstore_id)
+    
+    db = _load_index(main_dir, embeddings)
+    if db is None:
+        # No main index yet; the delta becomes it, under the same IVF policy
+        db = delta
+        _to_ivf_if_large(db)
+    else:
+        # The delta is always flat, so these are its exact float vectors
+        delta_vectors = _index_vectors(delta.index)
+        if not isinstance(db.index, faiss.IndexIVF):
+            # Decoding a flat main is exact. Indexes built before the switch
+            # to inner product hold L2 vectors that were never normalised;
+            # normalising is a no-op for the rest
+            main_vectors = _index_vectors(db.index)
+            faiss.normalize_L2(main_vectors)
+            if len(main_vectors) + len(delta_vectors) >= IVF_MIN_VECTORS:
+                target = _train_ivf_index([main_vectors, delta_vectors])
+            else:
+                target = faiss.IndexFlatIP(main_vectors.shape[1])
+            db.index = _index_with_vectors(target, main_vectors)
+        # An IVF main keeps its trained quantizers: the delta is simply added,
+        # so existing codes are never decoded or re-quantised and compaction
+        # costs O(delta). rebuild_faiss_index retrains from scratch
+        ids = [delta.index_to_docstore_id[i] for i in range(moved)]
+        docs = [delta.docstore.search(doc_id) for doc_id in ids]
+        db.add_embeddings(
+            zip([doc.page_content for doc in docs], delta_vectors),
+            metadatas=[doc.metadata for doc in docs],
+            ids=ids,
+        )
+    
+    # One manifest swap replaces the main index and drops the delta, so
+    # readers never see the moved vectors twice
+    write_manifest(FAISS_DIR, _save_version(db), None)
+    return moved
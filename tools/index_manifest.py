@@ -0,0 +1,69 @@
+"""Versioned layout of the FAISS index directory.
+
+Every save goes to a fresh directory under faiss_index/ that is never
+modified afterwards, and CURRENT.json names the main and delta directories in
+use. Writers swap the manifest atomically; readers resolve it once per load,
+so they always see a matching main/delta pair.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+from typing import Optional, Tuple
+
+MANIFEST_NAME = "CURRENT.json"
+VERSION_PREFIX = "v-"
+# Delta directory used before the manifest existed; the main index then
+# lived directly in faiss_index/
+LEGACY_DELTA_NAME = "delta"
+
+def _has_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "index.faiss"))
+
+def _read_names(faiss_dir: str) -> Tuple[Optional[str], Optional[str]]:
+    """Return the (main, delta) directory names relative to `faiss_dir`."""
+    try:
+        with open(os.path.join(faiss_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        main = os.curdir if _has_index(faiss_dir) else None
+        delta = LEGACY_DELTA_NAME if _has_index(os.path.join(faiss_dir, LEGACY_DELTA_NAME)) else None
+        return main, delta
+    return manifest["main"], manifest["delta"]
+
+def read_manifest(faiss_dir: str) -> Tuple[Optional[str], Optional[str]]:
+    """Return the (main, delta) index directories in use, None where absent."""
+    return tuple(
+        os.path.normpath(os.path.join(faiss_dir, name)) if name else None
+        for name in _read_names(faiss_dir)
+    )
+
+def new_version_dir(faiss_dir: str) -> str:
+    """Return a fresh, unused directory path to save an index version into."""
+    return os.path.join(faiss_dir, f"{VERSION_PREFIX}{time.time_ns()}-{uuid.uuid4().hex[:8]}")
+
+def write_manifest(faiss_dir: str, main: Optional[str], delta: Optional[str]) -> None:
+    """Atomically point readers at `main` and `delta`, then delete old versions.
+    The directories named by the manifest being replaced are kept until the
+    next swap, so a reader that resolved it just before can still open them.
+    """
+    previous = _read_names(faiss_dir)
+    manifest = {
+        "main": os.path.relpath(main, faiss_dir) if main else None,
+        "delta": os.path.relpath(delta, faiss_dir) if delta else None,
+        "previous": list(previous),
+    }
+    os.makedirs(faiss_dir, exist_ok=True)
+    manifest_path = os.path.join(faiss_dir, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.tmp.{uuid.uuid4().hex}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    keep = {manifest["main"], manifest["delta"], *previous}
+    for name in os.listdir(faiss_dir):
+        if (name.startswith(VERSION_PREFIX) or name == LEGACY_DELTA_NAME) and name not in keep:
+            # A reader may still have the files mapped; on Windows the delete
+            # then fails and is retried at the next swap
+            shutil.rmtree(os.path.join(faiss_dir, name), ignore_errors=True)
@@ -1,44 +1,84 @@
 from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
-from langchain.agents import AgentExecutor, create_sql_agent
-from langchain.agents.agent_types import AgentType
 from langchain_openai import ChatOpenAI
 import os
+import time
+import logging
+import functools
+from urllib.parse import quote_plus
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the server before a connection attempt fails
+MYSQL_CONNECT_TIMEOUT = 5
+# After a failed build, questions skip the database for this long instead of
+# each waiting on a connection attempt
+MYSQL_RETRY_SECONDS = 60
+
+_retry_after = 0.0
+_logged_unconfigured = False
+
+@functools.lru_cache(maxsize=1)
+def _build_agent(user: str, password: str, host: str, database: str):
+    """Build the SQL agent; cached per connection settings so a changed
+    password builds a fresh engine while repeat calls reuse the pool.
+    """
+    # langchain.agents pulls in langchain.chains; defer it until first use
+    from langchain.agents import create_sql_agent
+    from langchain.agents.agent_types import AgentType
+    
+    # Create connection string with proper escaping
+    password = quote_plus(password)  # Escape special characters in password
+    db_uri = f"mysql+pymysql://{user}:{password}@{host}/{database}"
+    
+    # Create database connection with a pooled engine; pre-ping transparently
+    # replaces connections the server dropped, and recycling retires them
+    # before MySQL's wait_timeout does
+    db = SQLDatabase.from_uri(
+        db_uri,
+        engine_args={
+            "pool_size": 5,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+            "connect_args": {"connect_timeout": MYSQL_CONNECT_TIMEOUT},
+        },
+    )
+    
+    # Create LLM
+    llm = ChatOpenAI(temperature=0)
+    
+    # Create SQL agent; the step-by-step trace (every query and full LLM
+    # response) is printed to stdout, so only emit it when debugging
+    return create_sql_agent(
+        llm=llm,
+        db=db,
+        agent_type=AgentType.OPENAI_FUNCTIONS,
+        verbose=logger.isEnabledFor(logging.DEBUG)
+    )
 
 def get_mysql_agent():
+    """Return the cached SQL agent, or None if it is not configured or the
+    database is unreachable. A failed build is retried after MYSQL_RETRY_SECONDS.
+    """
+    global _retry_after, _logged_unconfigured
+    
+    # Get MySQL configuration from environment variables
+    user = os.getenv('MYSQL_USER')
+    password = os.getenv('MYSQL_PASSWORD')
+    host = os.getenv('MYSQL_HOST')
+    database = os.getenv('MYSQL_DATABASE')
+    
+    # Without full configuration the database source is simply disabled
+    if not all([user, password, host, database]):
+        if not _logged_unconfigured:
+            logger.info("MySQL environment variables not set; database source disabled")
+            _logged_unconfigured = True
+        return None
+    
+    if time.monotonic() < _retry_after:
+        return None
     try:
-        # Get MySQL configuration from environment variables
-        user = os.getenv('MYSQL_USER')
-        password = os.getenv('MYSQL_PASSWORD')
-        host = os.getenv('MYSQL_HOST')
-        database = os.getenv('MYSQL_DATABASE')
-        
-        # Ensure all required variables are present
-        if not all([user, password, host, database]):
-            raise ValueError("Missing required MySQL environment variables")
-            
-        # Create connection string
-        # Create connection string with proper escaping
-        from urllib.parse import quote_plus
-        password = quote_plus(password)  # Escape special characters in password
-        db_uri = f"mysql+pymysql://{user}:{password}@{host}/{database}"
-        
-        # Create database connection
-        db = SQLDatabase.from_uri(db_uri)
-        
-        # Create LLM
-        llm = ChatOpenAI(temperature=0)
-        
-        # Create SQL agent
-        agent_executor = create_sql_agent(
-            llm=llm,
-            db=db,
-            agent_type=AgentType.OPENAI_FUNCTIONS,
-            verbose=True
-        )
-        
-        return agent_executor
+        return _build_agent(user, password, host, database)
     except Exception as e:
-        print(f"Error creating MySQL agent: {str(e)}")
-        # Return a dummy agent that will inform the user about the database connection issue
-        return lambda x: {"output": "Database connection is currently unavailable. Please try other sources."}
+        _retry_after = time.monotonic() + MYSQL_RETRY_SECONDS
+        logger.error("Error creating MySQL agent, retrying in %ds: %s", MYSQL_RETRY_SECONDS, e)
+        return None
@@ -1,14 +1,119 @@
 import os
+import functools
+import pickle
+from typing import List, Optional, Tuple
+import faiss
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.caches import InMemoryCache
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import RetrievalQA
+from tools.index_manifest import read_manifest
 
-def get_rag_chain():
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    faiss_dir = os.path.join(base_dir, "faiss_index")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Recent uploads live in a small delta index next to the main one
+# (see tools.file_upload.compact_faiss_index and tools.index_manifest)
+FAISS_DIR = os.path.join(BASE_DIR, "faiss_index")
+IVF_NPROBE = 8
+# Most recent RAG answers kept in memory, keyed by the full prompt
+RAG_LLM_CACHE_SIZE = 1000
+
+class MergedFAISSRetriever(BaseRetriever):
+    """Retrieve the overall top-k documents across several FAISS stores."""
+    stores: List[FAISS]
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # Embed the query once and search every store with the same vector
+        embedding = self.embeddings.embed_query(query)
+        scored = []
+        for store in self.stores:
+            results = store.similarity_search_with_score_by_vector(embedding, k=self.k)
+            if store.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                # Legacy L2 index: for unit vectors, squared L2 = 2 - 2 * cosine
+                results = [(doc, 1 - score / 2) for doc, score in results]
+            scored.extend(results)
+        # Scores are cosine similarities, so larger is closer
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return [doc for doc, _ in scored[:self.k]]
+
+def _mmap_flag(index_path: str) -> int:
+    """Pick the faiss mmap flag for the index type stored at `index_path`.
+    IO_FLAG_MMAP only maps IVF inverted lists and IO_FLAG_MMAP_IFC only maps
+    flat codes; faiss rejects the two combined, so go by the file's fourcc.
+    """
+    with open(index_path, "rb") as f:
+        fourcc = f.read(4)
+    # IVF indexes are tagged "Iw..", flat ones "IxF."
+    return faiss.IO_FLAG_MMAP if fourcc.startswith(b"Iw") else faiss.IO_FLAG_MMAP_IFC
+
+def _load_index_mmap(faiss_dir: str, embeddings) -> FAISS:
+    """Load a saved FAISS store read-only, memory-mapping the vector data.
+    Pages are faulted in on demand and shared between processes instead of
+    being copied into each process's heap. Writers must use FAISS.load_local.
+    """
+    index_path = os.path.join(faiss_dir, "index.faiss")
+    index = faiss.read_index(index_path, _mmap_flag(index_path) | faiss.IO_FLAG_READ_ONLY)
+    if isinstance(index, faiss.IndexIVF):
+        # Number of IVF clusters scanned per query
+        index.nprobe = IVF_NPROBE
+    # index.pkl holds the (docstore, index_to_docstore_id) pair written by save_local
+    with open(os.path.join(faiss_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        normalize_L2=True,
+    )
+
+# The OpenAI clients outlive index reloads, keeping their HTTP connection pools
+@functools.lru_cache(maxsize=1)
+def _get_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings()
+
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> ChatOpenAI:
+    # A repeated question over the same retrieved context is answered from
+    # memory; new uploads change the context and so miss the cache. Answers
+    # are deterministic so that a cached one is the answer a call would give
+    return ChatOpenAI(temperature=0, cache=InMemoryCache(maxsize=RAG_LLM_CACHE_SIZE))
+
+@functools.lru_cache(maxsize=1)
+def _load_rag_chain(index_dirs: Tuple[Optional[str], Optional[str]]):
+    """Build the RetrievalQA chain over the (main, delta) index directories.
+    Index versions are never modified in place, so the paths key the cache.
+    """
+    # langchain.chains is slow to import; defer it until a chain is needed
+    from langchain.chains import RetrievalQA
     
-    embeddings = OpenAIEmbeddings()
-    db = FAISS.load_local(faiss_dir, embeddings, allow_dangerous_deserialization=True)
-    retriever = db.as_retriever()
-    qa_chain = RetrievalQA.from_chain_type(llm=ChatOpenAI(), retriever=retriever)
+    embeddings = _get_embeddings()
+    stores = [
+        _load_index_mmap(faiss_dir, embeddings)
+        for faiss_dir in index_dirs
+        if faiss_dir is not None
+    ]
+    if len(stores) == 1:
+        retriever = stores[0].as_retriever()
+    else:
+        retriever = MergedFAISSRetriever(stores=stores, embeddings=embeddings)
+    qa_chain = RetrievalQA.from_chain_type(llm=_get_llm(), retriever=retriever)
     return qa_chain
+
+def get_rag_chain():
+    """Return the RAG chain, reloading the indexes only when they changed on disk.
+    Returns None when no index has been built yet.
+    """
+    # Resolve the manifest once so main and delta always come from the same swap
+    index_dirs = read_manifest(FAISS_DIR)
+    if index_dirs == (None, None):
+        return None
+    return _load_rag_chain(index_dirs)
@@ -1,7 +1,16 @@
 import os
+import logging
+import threading
+from cachetools import TTLCache
 from langchain.tools import Tool
 from serpapi import GoogleSearch
 
+logger = logging.getLogger(__name__)
+
+# Snippets for recent queries; only successful lookups are cached
+_search_cache = TTLCache(maxsize=1000, ttl=600)
+_search_cache_lock = threading.Lock()
+
 def get_serp_tool():
     try:
         api_key = os.getenv('SERPAPI_API_KEY')
@@ -9,6 +18,13 @@ def get_serp_tool():
             raise ValueError("SERPAPI_API_KEY environment variable not set")
             
         def search_with_error_handling(query: str) -> str:
+            # Repeated questions are answered from the cache without a request
+            cache_key = query.strip().lower()
+            with _search_cache_lock:
+                cached = _search_cache.get(cache_key)
+            if cached:
+                return cached
+            
             try:
                 # Create search parameters
                 params = {
@@ -27,10 +43,12 @@ def get_serp_tool():
                     first_result = results["organic_results"][0]
                     snippet = first_result.get("snippet", "")
                     if snippet:
+                        with _search_cache_lock:
+                            _search_cache[cache_key] = snippet
                         return snippet
                 return None
             except Exception as e:
-                print(f"Error in SerpAPI search: {str(e)}")
+                logger.error("Error in SerpAPI search: %s", e)
                 return None
         
         # Create tool
@@ -41,5 +59,5 @@ def get_serp_tool():
             return_direct=True
         )
     except Exception as e:
-        print(f"Error creating SerpAPI tool: {str(e)}")
+        logger.error("Error creating SerpAPI tool: %s", e)
         return None